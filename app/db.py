@@ -6,9 +6,22 @@ from pathlib import Path
 DB_URL = os.getenv("DB_URL", "sqlite:///./data/demo.db")
 Path("data").mkdir(exist_ok=True)
 
-# SQLite için check_same_thread
-engine = create_engine(DB_URL, connect_args={"check_same_thread": False} if DB_URL.startswith("sqlite") else {})
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+if DB_URL.startswith("sqlite"):
+    # SQLite için check_same_thread
+    engine_kwargs = {"connect_args": {"check_same_thread": False}}
+else:
+    # sync endpoint'ler threadpool'da paralel koşar; varsayılan havuz (5) istekleri sıraya sokar
+    engine_kwargs = {
+        "pool_size": int(os.getenv("DB_POOL_SIZE", "20")),
+        "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        # her checkout'ta SELECT 1 yerine bağlantılar pool_recycle ile yenilenir;
+        # kopan bağlantıda SQLAlchemy havuzu geçersiz kılar. Gerekirse DB_POOL_PRE_PING=1
+        "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "0") == "1",
+        "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    }
+engine = create_engine(DB_URL, **engine_kwargs)
+# commit sonrası nesneler geçerli kalır; id vb. için ekstra refresh SELECT'i gerekmez
+SessionLocal = sessionmaker(autocommit=False, autoflush=False, expire_on_commit=False, bind=engine)
 Base = declarative_base()
 
 def get_db():
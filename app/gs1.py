@@ -7,6 +7,17 @@ from typing import Optional, Tuple
 # (10) = Batch/Lot
 # Metinden SKT yakalama için TR/EN anahtar kelimeler de var.
 
+# desenler modül yüklenirken bir kez derlenir
+# (17) ve (10) tek desende: metin bir kez taranır
+_GS1_AI = re.compile(r"\((?P<ai>17|10)\)\s*(?P<val>[A-Za-z0-9\-_.]+)")
+# Ortak tarih formatları
+#  DD.MM.YYYY | DD/MM/YYYY | YYYY-MM-DD | DD-MM-YYYY | DD.MM.YY | DD/MM/YY
+_DATE_PATS = [
+    re.compile(r"(\d{1,2})[./-](\d{1,2})[./-](\d{4})"),
+    re.compile(r"(\d{4})[./-](\d{1,2})[./-](\d{1,2})"),
+    re.compile(r"(\d{1,2})[./-](\d{1,2})[./-](\d{2})"),
+]
+
 def parse_gs1_from_text(s: str) -> Tuple[Optional[datetime], Optional[str]]:
     """
     GS1 string içinden (17)YYYYMMDD ve (10)LotCode ayrıştırır.
@@ -14,17 +25,21 @@ def parse_gs1_from_text(s: str) -> Tuple[Optional[datetime], Optional[str]]:
     """
     if not s:
         return None, None
-    # AI (17) -> YYMMDD
-    m_exp = re.search(r"\(17\)\s*(\d{6})", s)
-    expiry = None
-    if m_exp:
-        yy, mm, dd = m_exp.group(1)[0:2], m_exp.group(1)[2:4], m_exp.group(1)[4:6]
-        # 20xx varsayımı
-        year = 2000 + int(yy)
-        expiry = datetime(year, int(mm), int(dd))
-    # AI (10) -> LOT (değişken uzunluk, sonraki parantez veya EOL'e kadar)
-    m_lot = re.search(r"\(10\)\s*([A-Za-z0-9\-_.]+)", s)
-    lot = m_lot.group(1) if m_lot else None
+    expiry, lot = None, None
+    for m in _GS1_AI.finditer(s):
+        val = m.group("val")
+        if m.group("ai") == "17":
+            # AI (17) -> YYMMDD (ilk 6 hane; rakam değilse sonraki (17)'ye bak)
+            if expiry is None and len(val) >= 6 and val[:6].isdigit():
+                yy, mm, dd = val[0:2], val[2:4], val[4:6]
+                # 20xx varsayımı
+                year = 2000 + int(yy)
+                expiry = datetime(year, int(mm), int(dd))
+        elif lot is None:
+            # AI (10) -> LOT (değişken uzunluk, sonraki parantez veya EOL'e kadar)
+            lot = val
+        if expiry is not None and lot is not None:
+            break
     return expiry, lot
 
 def parse_expiry_from_free_text(s: str) -> Optional[datetime]:
@@ -33,19 +48,9 @@ def parse_expiry_from_free_text(s: str) -> Optional[datetime]:
     """
     if not s:
         return None
-    # Ortak tarih formatları
-    #  DD.MM.YYYY | DD/MM/YYYY | YYYY-MM-DD | DD-MM-YYYY | DD.MM.YY | DD/MM/YY
-    pats = [
-        r"(\d{1,2})[./-](\d{1,2})[./-](\d{4})",
-        r"(\d{4})[./-](\d{1,2})[./-](\d{1,2})",
-        r"(\d{1,2})[./-](\d{1,2})[./-](\d{2})",
-    ]
     s_norm = s.strip()
-    # Anahtar kelime ipucuları: SKT, TETT, EXP, Use by, Son kullanma
-    if re.search(r"\b(SKT|TETT|EXP|Use\s*by|Son\s*kullanma)\b", s_norm, re.IGNORECASE):
-        pass
-    for p in pats:
-        m = re.search(p, s_norm)
+    for p in _DATE_PATS:
+        m = p.search(s_norm)
         if not m:
             continue
         g = m.groups()
@@ -1,6 +1,8 @@
 # app/logic.py
 from datetime import datetime, date, timedelta
+import numpy as np
 import pandas as pd
+from sqlalchemy import func, insert
 from sqlalchemy.orm import Session
 from .models import Batch, ExpiryAlert, Sale, Forecast
 
@@ -19,6 +21,16 @@ def refresh_expiry_alerts(db: Session, store_id: int, days_window: int = 7):
         Batch.expiry_date <= cutoff
     ).all()
 
+    # mevcut alert'ler tek IN sorgusuyla (batch başına SELECT yok)
+    existing_map = {}
+    batch_ids = [b.id for b in batches]
+    if batch_ids:
+        alerts = (db.query(ExpiryAlert)
+                    .filter(ExpiryAlert.store_id == store_id, ExpiryAlert.batch_id.in_(batch_ids))
+                    .order_by(ExpiryAlert.id).all())
+        for a in alerts:
+            existing_map.setdefault((a.batch_id, a.product_id), a)
+
     for b in batches:
         if not b.expiry_date:
             continue
@@ -29,11 +41,7 @@ def refresh_expiry_alerts(db: Session, store_id: int, days_window: int = 7):
         sev = "red" if days_left <= 3 else "yellow"
 
         # Eğer aynı batch için zaten bir alert varsa güncelle, yoksa ekle.
-        existing = db.query(ExpiryAlert).filter_by(
-            store_id=store_id,
-            batch_id=b.id,
-            product_id=b.product_id
-        ).first()
+        existing = existing_map.get((b.id, b.product_id))
 
         if existing:
             changed = False
@@ -60,30 +68,38 @@ def refresh_expiry_alerts(db: Session, store_id: int, days_window: int = 7):
 
 
 def naive_hourly_forecast(db: Session, store_id: int, product_id: int, horizon_days: int = 7):
-    rows = db.query(Sale).filter(Sale.store_id == store_id, Sale.product_id == product_id).all()
-    if not rows:
+    # yalnızca son 28 günün satışları çekilir; tüm geçmiş belleğe alınmaz
+    end_ts = db.query(func.max(Sale.ts)).filter(Sale.store_id == store_id, Sale.product_id == product_id).scalar()
+    if end_ts is None:
         return []
+    # ORM nesnesi/dict listesi yerine iki kolonluk tuple'lar doğrudan DataFrame'e
+    rows = db.query(Sale.ts, Sale.qty).filter(
+        Sale.store_id == store_id,
+        Sale.product_id == product_id,
+        Sale.ts >= end_ts - timedelta(days=28)
+    ).all()
 
-    df = pd.DataFrame([{"ts": r.ts, "qty": r.qty} for r in rows]).sort_values("ts")
+    df = pd.DataFrame(rows, columns=["ts", "qty"])
     if not pd.api.types.is_datetime64_any_dtype(df["ts"]):
         df["ts"] = pd.to_datetime(df["ts"])
 
-    df["dow"] = df["ts"].dt.dayofweek
-    df["hour"] = df["ts"].dt.hour
-
-    end = df["ts"].max()
-    recent_cutoff = end - pd.Timedelta(days=28)
-    recent = df[df["ts"] >= recent_cutoff]
-    if recent.empty:
-        recent = df
+    # pencere SQL'de uygulandı; son zaman damgası da zaten sorgulandı
+    end = pd.Timestamp(end_ts)
 
-    grp = recent.groupby(["dow", "hour"])["qty"].mean().rename("yhat").reset_index()
+    # (dow, hour) -> dow*24+hour yoğun [0,168) anahtar: groupby/merge yerine
+    # bincount ile 168'lik ortalama tablosu (NaN qty'ler groupby.mean gibi atlanır)
+    keys = (df["ts"].dt.dayofweek * 24 + df["ts"].dt.hour).to_numpy()
+    qty = df["qty"].to_numpy(dtype=float)
+    valid = ~np.isnan(qty)
+    counts = np.bincount(keys[valid], minlength=168)
+    sums = np.bincount(keys[valid], weights=qty[valid], minlength=168)
+    mean_table = np.divide(sums, counts, out=np.zeros(168), where=counts > 0)
 
-    future = pd.date_range(end + pd.Timedelta(hours=1), periods=horizon_days * 24, freq="H")
+    future = pd.date_range(end + pd.Timedelta(hours=1), periods=horizon_days * 24, freq=pd.Timedelta(hours=1))
     fut = pd.DataFrame({"ts": future})
     fut["dow"] = fut["ts"].dt.dayofweek
     fut["hour"] = fut["ts"].dt.hour
-    fut = fut.merge(grp, on=["dow", "hour"], how="left").fillna(0.0)
+    fut["yhat"] = mean_table[(fut["dow"] * 24 + fut["hour"]).to_numpy()]
 
     # Idempotent: aynı zaman aralığındaki eski Forecast'leri sil
     try:
@@ -98,15 +114,13 @@ def naive_hourly_forecast(db: Session, store_id: int, product_id: int, horizon_d
     except Exception:
         db.rollback()
 
-    for _, r in fut.iterrows():
-        rec = Forecast(
-            store_id=store_id,
-            product_id=product_id,
-            horizon="hourly",
-            ts=r["ts"].to_pydatetime(),
-            yhat=float(r["yhat"])
-        )
-        db.add(rec)
+    # iterrows + satır başına ORM nesnesi yerine kolon dizilerinden tek executemany INSERT
+    records = [
+        {"store_id": store_id, "product_id": product_id, "horizon": "hourly", "ts": ts, "yhat": float(y)}
+        for ts, y in zip(pd.DatetimeIndex(fut["ts"]).to_pydatetime(), fut["yhat"].to_numpy(dtype=float))
+    ]
+    if records:
+        db.execute(insert(Forecast), records)
     db.commit()
     return fut
 
@@ -114,8 +128,14 @@ def naive_hourly_forecast(db: Session, store_id: int, product_id: int, horizon_d
 def reorder_suggestion(current_stock: float, lead_time_days: int, safety_stock: float, forecast_df) -> int:
     if forecast_df is None or forecast_df.empty:
         return 0
-    start = forecast_df["ts"].min()
-    horizon_limit = forecast_df[forecast_df["ts"] <= (start + pd.Timedelta(days=lead_time_days))]
-    expected = float(horizon_limit["yhat"].sum()) if not horizon_limit.empty else 0.0
+    # maske/ara DataFrame yerine sıralı ts üzerinde searchsorted ile kesim noktası
+    ts = pd.to_datetime(forecast_df["ts"]).to_numpy()
+    yhat = forecast_df["yhat"].to_numpy(dtype=float)
+    if not forecast_df["ts"].is_monotonic_increasing:
+        order = np.argsort(ts, kind="stable")
+        ts, yhat = ts[order], yhat[order]
+    cutoff = ts[0] + np.timedelta64(lead_time_days, "D")
+    idx = np.searchsorted(ts, cutoff, side="right")
+    expected = float(np.nansum(yhat[:idx]))
     qty_to_order = max(0, int(round(safety_stock + expected - float(current_stock))))
     return qty_to_order
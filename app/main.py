@@ -1,20 +1,24 @@
 # app/main.py
 import os
 import io
+import asyncio
 import csv
 import json
 import secrets
 from datetime import datetime, date, timedelta
+import pandas as pd
 from fastapi import FastAPI, UploadFile, File, Depends, HTTPException, Path, Body, Request, status
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from fastapi.responses import RedirectResponse, StreamingResponse
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from sqlalchemy.orm import Session
-from sqlalchemy import func
+from sqlalchemy import func, insert, text, inspect
 from pydantic import BaseModel
 from typing import List
-from sqlalchemy import or_
+from sqlalchemy import or_, and_
+from sqlalchemy.exc import IntegrityError
 
 from .db import Base, engine, get_db
 from .models import *
@@ -22,16 +26,22 @@ from .schemas import *
 from .ocr import run_tesseract, run_vision_fallback, best_merge
 from .parsers import parse_invoice_lines
 from .logic import refresh_expiry_alerts, naive_hourly_forecast, reorder_suggestion
-from .utils import save_upload, file_md5
+from .utils import save_upload, save_upload_md5
 from .match import build_product_name_map, fuzzy_match_product
 from .gs1 import parse_gs1_from_text, parse_expiry_from_free_text
 
 # ——————————————————— YENİ: BASIC AUTH ———————————————————
 security = HTTPBasic()
 
+# beklenen kimlik bilgileri import'ta bir kez okunup bytes'a çevrilir (istek başına değil)
+AUTH_USERNAME = os.getenv("AUTH_USERNAME", "admin").encode("utf8")
+AUTH_PASSWORD = os.getenv("AUTH_PASSWORD", "retailai2025").encode("utf8")  # istediğin zaman değiştir
+
 def verify_auth(credentials: HTTPBasicCredentials = Depends(security)):
-    correct_username = secrets.compare_digest(credentials.username, "admin")
-    correct_password = secrets.compare_digest(credentials.password, "retailai2025")  # istediğin zaman değiştir
+    # iki karşılaştırma da her zaman çalışır (kullanıcı adı yanlışken de) → sabit süreli yol.
+    # kimlik bilgileri UTF-8 byte dizisi olarak birebir karşılaştırılır
+    correct_username = secrets.compare_digest(credentials.username.encode("utf8"), AUTH_USERNAME)
+    correct_password = secrets.compare_digest(credentials.password.encode("utf8"), AUTH_PASSWORD)
     if not (correct_username and correct_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -55,13 +65,46 @@ app = FastAPI(
 async def health():
     return {"status": "ok", "timestamp": datetime.utcnow().isoformat()}
 
+# virgülle ayrılmış liste; import'ta bir kez ayrıştırılır
+CORS_ORIGINS = [o.strip() for o in os.getenv("CORS_ORIGINS", "*").split(",") if o.strip()] or ["*"]
+
 app.add_middleware(
-    CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]
+    CORSMiddleware, allow_origins=CORS_ORIGINS, allow_methods=["*"], allow_headers=["*"]
 )
 
+# OCR eşzamanlılığı CPU sayısıyla sınırlı: threadpool (40 thread) dolarsa
+# onlarca tesseract süreci aynı anda CPU için yarışır
+# Semaphore ilk kullanıldığı event loop'a bağlanır; import'ta değil, çalışan loop
+# için tembel oluşturulur (loop değişirse, ör. ardışık TestClient'lar, yenilenir)
+_OCR_SEM: asyncio.Semaphore | None = None
+_OCR_SEM_LOOP = None
+
+def _ocr_sem() -> asyncio.Semaphore:
+    global _OCR_SEM, _OCR_SEM_LOOP
+    loop = asyncio.get_running_loop()
+    if _OCR_SEM is None or _OCR_SEM_LOOP is not loop:
+        _OCR_SEM = asyncio.Semaphore(os.cpu_count() or 1)
+        _OCR_SEM_LOOP = loop
+    return _OCR_SEM
+
+async def _ocr_in_thread(fn, img_path: str) -> dict:
+    async with _ocr_sem():
+        return await run_in_threadpool(fn, img_path)
+
 # -----------------------------
 # P0-1) Upload + MD5 Duplicate
 # -----------------------------
+def _reject_duplicate(img_path: str, existing_id: int | None):
+    # kopya dosya diskte yetim kalmasın
+    try:
+        os.remove(img_path)
+    except OSError:
+        pass
+    raise HTTPException(
+        status_code=409,
+        detail={"message": "Duplicate invoice image", "existing_invoice_id": existing_id}
+    )
+
 @app.post("/upload_invoice", response_model=InvoiceUploadResp)
 async def upload_invoice(
     file: UploadFile = File(...),
@@ -69,33 +112,30 @@ async def upload_invoice(
     supplier_id: int = 1,
     db: Session = Depends(get_db)
 ):
-    # 1) Dosyayı kaydet
-    img_path = save_upload(file, "invoice")
+    # 1) Dosyayı kaydet + MD5 (tek geçişte, threadpool'da; event loop bloklanmaz)
+    img_path, h = await run_in_threadpool(save_upload_md5, file, "invoice")
 
     # 2) Duplicate kontrolü
-    h = file_md5(img_path)
-    dup = db.query(Invoice).filter(Invoice.file_hash == h).first()
+    dup = db.query(Invoice.id).filter(Invoice.file_hash == h).first()
     if dup:
-        raise HTTPException(
-            status_code=409,
-            detail={"message": "Duplicate invoice image", "existing_invoice_id": dup.id}
-        )
+        _reject_duplicate(img_path, dup.id)
 
-    # 3) OCR & parse
-    ocr = run_tesseract(img_path)
+    # 3) OCR & parse (CPU-ağır; event loop'u bloklamasın diye threadpool'da)
+    ocr = await _ocr_in_thread(run_tesseract, img_path)
     lines = parse_invoice_lines(ocr.get("text", ""))
 
     # düşük güven/çıktı durumunda fallback
     if len(lines) == 0 or ocr.get("conf", 0) < 0.6:
-        ocr2 = run_vision_fallback(img_path)
+        ocr2 = await _ocr_in_thread(run_vision_fallback, img_path)
         ocr = best_merge(ocr, ocr2)
         lines = parse_invoice_lines(ocr.get("text", ""))
 
     # 4) ürün eşleştirme için name map (fuzzy yedeği)
-    products = [{"id": p.id, "name": p.name} for p in db.query(Product).all()]
+    products = [{"id": pid, "name": name} for pid, name in db.query(Product.id, Product.name).all()]
     pmap = build_product_name_map(products)
 
-    # 5) faturayı kaydet (önce header)
+    # 5) faturayı kaydet (önce header). flush inv.id'yi verir; header + satırlar
+    # tek transaction/commit'te yazılır, satırlar patlarsa yarım fatura kalmaz
     inv = Invoice(
         store_id=store_id,
         supplier_id=supplier_id,
@@ -105,8 +145,23 @@ async def upload_invoice(
         file_hash=h,
     )
     db.add(inv)
-    db.commit()
-    db.refresh(inv)
+    try:
+        db.flush()
+    except IntegrityError:
+        # OCR sürerken aynı dosya başka istekle kaydedildi (file_hash unique)
+        db.rollback()
+        dup = db.query(Invoice.id).filter(Invoice.file_hash == h).first()
+        _reject_duplicate(img_path, dup.id if dup else None)
+
+    # barkodlu satırların ürünleri tek IN sorgusuyla (satır başına sorgu yok)
+    barcodes = {L["barcode"] for L in lines if L.get("barcode")}
+    by_barcode = {}
+    if barcodes:
+        rows = (db.query(Product.barcode_gtin, Product.id, Product.name)
+                  .filter(Product.barcode_gtin.in_(barcodes))
+                  .order_by(Product.id).all())
+        for gtin, p_id, p_name in rows:
+            by_barcode.setdefault(gtin, (p_id, p_name))
 
     # 6) satırları ekle
     for L in lines:
@@ -115,11 +170,8 @@ async def upload_invoice(
 
         # 6-a) Barkod ile direkt eşle (varsa)
         barcode = L.get("barcode")
-        if barcode:
-            p = db.query(Product).filter(Product.barcode_gtin == barcode).first()
-            if p:
-                pid = p.id
-                product_name = p.name
+        if barcode and barcode in by_barcode:
+            pid, product_name = by_barcode[barcode]
 
         # 6-b) Barkod yoksa/fail ise fuzzy isim ile dene
         if pid is None:
@@ -151,21 +203,29 @@ async def upload_invoice(
 # -----------------------------
 @app.get("/invoice/{invoice_id}")
 def get_invoice(invoice_id: int = Path(...), db: Session = Depends(get_db)):
-    inv = db.query(Invoice).filter_by(id=invoice_id).first()
-    if not inv:
+    # başlık + satırlar + eşleşen ürün adı tek sorguda (ocr_json çekilmez);
+    # satırı olmayan fatura için tek satır, InvoiceLine None döner
+    rows = (db.query(Invoice.created_at, InvoiceLine, Product.name)
+              .outerjoin(InvoiceLine, InvoiceLine.invoice_id == Invoice.id)
+              .outerjoin(Product, Product.id == InvoiceLine.product_id)
+              .filter(Invoice.id == invoice_id)
+              .order_by(InvoiceLine.id)
+              .all())
+    if not rows:
         raise HTTPException(status_code=404, detail="invoice not found")
-    lines = db.query(InvoiceLine).filter_by(invoice_id=invoice_id).all()
+    created_at = rows[0][0]
     return {
-        "invoice_id": inv.id,
-        "created_at": inv.created_at.isoformat() if inv.created_at else None,
+        "invoice_id": invoice_id,
+        "created_at": created_at.isoformat() if created_at else None,
         "lines": [{
             "id": L.id,
             "product_id": L.product_id,
+            "matched_name": matched_name,
             "name_raw": L.name_raw,
             "qty": L.qty,
             "unit": L.unit,
             "unit_price": L.unit_price
-        } for L in lines]
+        } for _, L, matched_name in rows if L is not None]
     }
 
 class UpdateLineReq(BaseModel):
@@ -175,26 +235,17 @@ class UpdateLineReq(BaseModel):
     unit_price: float | None = None
     name_raw: str | None = None
 
-class ProductCreate(BaseModel):
-    sku: str
-    name: str
-    category: str | None = None
-    barcode_gtin: str | None = None
-    shelf_life_days: int | None = None
-
 @app.post("/invoice/line/update")
 def update_line(body: UpdateLineReq, db: Session = Depends(get_db)):
-    L = db.query(InvoiceLine).filter_by(id=body.line_id).first()
-    if not L:
+    # önce SELECT sonra UPDATE yerine tek UPDATE; etkilenen satır yoksa 404
+    values = body.model_dump(exclude={"line_id"}, exclude_none=True)
+    q = db.query(InvoiceLine).filter_by(id=body.line_id)
+    if values:
+        found = q.update(values, synchronize_session=False)
+    else:
+        found = db.query(InvoiceLine.id).filter_by(id=body.line_id).first() is not None
+    if not found:
         raise HTTPException(status_code=404, detail="line not found")
-    if body.product_id is not None:
-        L.product_id = body.product_id
-    if body.qty is not None:
-        L.qty = body.qty
-    if body.unit_price is not None:
-        L.unit_price = body.unit_price
-    if body.name_raw is not None:
-        L.name_raw = body.name_raw
     db.commit()
     return {"ok": True}
 
@@ -203,30 +254,30 @@ def update_line(body: UpdateLineReq, db: Session = Depends(get_db)):
 # -----------------------------
 @app.get("/invoice/{invoice_id}/export.csv")
 def export_invoice_csv(invoice_id: int, db: Session = Depends(get_db)):
-    inv = db.query(Invoice).filter_by(id=invoice_id).first()
-    if not inv:
+    # varlık kontrolü + satırlar + barkod tek sorguda (ayrı Product IN sorgusu yok)
+    # NULL'lar SQL tarafında boş/0'a çevrilir
+    rows = (db.query(InvoiceLine.id,
+                     func.coalesce(Product.barcode_gtin, ""),
+                     func.coalesce(InvoiceLine.name_raw, ""),
+                     func.coalesce(InvoiceLine.qty, 0.0),
+                     func.coalesce(InvoiceLine.unit_price, 0.0))
+              .select_from(Invoice)
+              .outerjoin(InvoiceLine, InvoiceLine.invoice_id == Invoice.id)
+              .outerjoin(Product, Product.id == InvoiceLine.product_id)
+              .filter(Invoice.id == invoice_id)
+              .order_by(InvoiceLine.id)
+              .all())
+    if not rows:
         raise HTTPException(status_code=404, detail="invoice not found")
 
-    lines = db.query(InvoiceLine).filter_by(invoice_id=invoice_id).all()
-
-    # product_id -> Product map (barcode çekmek için)
-    pids = [L.product_id for L in lines if L.product_id]
-    prod_map = {}
-    if pids:
-        prods = db.query(Product).filter(Product.id.in_(pids)).all()
-        prod_map = {p.id: p for p in prods}
-
     buf = io.StringIO()
     w = csv.writer(buf)
     w.writerow(["barcode", "name", "qty", "unit_price", "line_total"])
 
-    for L in lines:
-        barcode = ""
-        if L.product_id and L.product_id in prod_map:
-            barcode = prod_map[L.product_id].barcode_gtin or ""
-        name = L.name_raw or ""
-        qty = float(L.qty or 0)
-        unit_price = float(L.unit_price or 0)
+    for line_id, barcode, name, qty, unit_price in rows:
+        if line_id is None:
+            continue
+        qty, unit_price = float(qty), float(unit_price)
         line_total = round(qty * unit_price, 2)
         w.writerow([barcode, name, qty, unit_price, line_total])
 
@@ -240,14 +291,22 @@ def export_invoice_csv(invoice_id: int, db: Session = Depends(get_db)):
 # -----------------------------
 # Helper endpoint: recent invoices (debug / UI için)
 # -----------------------------
+def _recent_invoices(db: Session, limit: int, before_id: int | None = None) -> list:
+    # satır sayıları faturalarla aynı sorguda (fatura başına ayrı COUNT yok)
+    qs = (db.query(Invoice.id, Invoice.created_at, func.count(InvoiceLine.id))
+            .outerjoin(InvoiceLine, InvoiceLine.invoice_id == Invoice.id))
+    # keyset sayfalama: sonraki (daha eski) sayfa için son görülen id'yi before_id olarak gönder
+    if before_id is not None:
+        qs = qs.filter(Invoice.id < before_id)
+    rows = (qs.group_by(Invoice.id, Invoice.created_at)
+              .order_by(Invoice.id.desc())
+              .limit(limit).all())
+    return [{"id": inv_id, "created_at": created_at.isoformat() if created_at else None, "line_count": cnt}
+            for inv_id, created_at, cnt in rows]
+
 @app.get("/invoices/recent")
-def invoices_recent(limit: int = 20, db: Session = Depends(get_db)):
-    q = db.query(Invoice).order_by(Invoice.id.desc()).limit(limit).all()
-    out = []
-    for inv in q:
-        cnt = db.query(InvoiceLine).filter_by(invoice_id=inv.id).count()
-        out.append({"id": inv.id, "created_at": inv.created_at.isoisoformat() if inv.created_at else None, "line_count": cnt})
-    return out
+def invoices_recent(limit: int = 20, before_id: int | None = None, db: Session = Depends(get_db)):
+    return _recent_invoices(db, limit, before_id)
 
 # -----------------------------
 # Diğer mevcut endpointler (hepsi otomatik auth’lu artık)
@@ -262,21 +321,19 @@ def batch_scan(payload: BatchScanReq, db: Session = Depends(get_db)):
         qty_received=payload.qty,
         qty_on_hand=payload.qty
     )
-    db.add(b); db.commit(); db.refresh(b)
+    db.add(b); db.commit()
     return {"batch_id": b.id, "status": "ok"}
 
 @app.post("/ingest_sales")
 def ingest_sales(body: IngestSalesReq, db: Session = Depends(get_db)):
-    sku_to_id = {p.sku: p.id for p in db.query(Product).all()}
-    added = 0
-    for r in body.rows:
-        pid = sku_to_id.get(r.sku)
-        if not pid:
-            continue
-        s = Sale(store_id=body.store_id, product_id=pid, ts=r.ts, qty=r.qty)
-        db.add(s); added += 1
+    sku_to_id = dict(db.query(Product.sku, Product.id).all())
+    # satır satır db.add yerine tek executemany INSERT
+    rows = [{"store_id": body.store_id, "product_id": sku_to_id[r.sku], "ts": r.ts, "qty": r.qty}
+            for r in body.rows if sku_to_id.get(r.sku)]
+    if rows:
+        db.execute(insert(Sale), rows)
     db.commit()
-    return {"inserted": added}
+    return {"inserted": len(rows)}
 
 @app.get("/alerts/expiry")
 def get_expiry_alerts(store_id: int = 1, days: int = 7, db: Session = Depends(get_db)):
@@ -300,16 +357,20 @@ def reorder_suggestions(store_id: int, product_id: int, current_stock: float = 0
     pol = db.query(ReorderPolicy).filter_by(store_id=store_id, product_id=product_id).first()
     if not pol:
         pol = ReorderPolicy(store_id=store_id, product_id=product_id,
-                            min_stock=0, max_stock=0, lead_time_days=2, safety_stock=1)
-        db.add(pol); db.commit(); db.refresh(pol)
+                            min_stock=0, max_stock=0, lead_time_days=2, safety_stock=1.0)
+        db.add(pol); db.commit()
 
-    existed = db.query(Forecast).filter_by(store_id=store_id, product_id=product_id).first()
+    existed = db.query(Forecast.id).filter_by(store_id=store_id, product_id=product_id, horizon="hourly").first()
     if not existed:
         naive_hourly_forecast(db, store_id, product_id, horizon_days=7)
 
-    import pandas as pd
-    fc_rows = db.query(Forecast).filter_by(store_id=store_id, product_id=product_id).all()
-    fdf = pd.DataFrame([{"ts": r.ts, "yhat": r.yhat} for r in fc_rows]).sort_values("ts")
+    # sıralama DB'de: horizon da sabitlenince (store, product, horizon, ts) index'i
+    # satırları ts sırasıyla verir; pandas tarafında ayrıca sort yok
+    fc_rows = (db.query(Forecast.ts, Forecast.yhat)
+                 .filter(Forecast.store_id == store_id, Forecast.product_id == product_id,
+                         Forecast.horizon == "hourly")
+                 .order_by(Forecast.ts).all())
+    fdf = pd.DataFrame(fc_rows, columns=["ts", "yhat"])
     qty = reorder_suggestion(current_stock, pol.lead_time_days, pol.safety_stock, fdf)
     return {
         "product_id": product_id,
@@ -328,11 +389,13 @@ def seed_products(db: Session = Depends(get_db)):
     {"sku":"EKM200","name":"Ekmek 200g","category":"firin","barcode_gtin":"869000000003","shelf_life_days":2,
      "image_url":"https://i.hizliresim.com/123abc/ekmek.jpg"},
 ]
+    # varlık kontrolü tek sorguda ve yalnızca sku kolonu üzerinden
+    existing = {sku for (sku,) in db.query(Product.sku).filter(Product.sku.in_([d["sku"] for d in demo]))}
     for d in demo:
-        if not db.query(Product).filter_by(sku=d["sku"]).first():
+        if d["sku"] not in existing:
             db.add(Product(**d))
     db.commit()
-    return {"ok": True, "count": db.query(Product).count()}
+    return {"ok": True, "count": db.query(func.count(Product.id)).scalar()}
 
 @app.post("/batch/scan_from_image")
 async def batch_scan_from_image(
@@ -342,8 +405,9 @@ async def batch_scan_from_image(
     qty: float = 1.0,
     db: Session = Depends(get_db)
 ):
-    img_path = save_upload(file, "label")
-    ocr = run_tesseract(img_path)
+    # disk yazımı threadpool'da; event loop bloklanmaz
+    img_path = await run_in_threadpool(save_upload, file, "label")
+    ocr = await _ocr_in_thread(run_tesseract, img_path)
     text = ocr.get("text","").strip()
     if not text:
         raise HTTPException(status_code=400, detail="Metin okunamadı")
@@ -356,41 +420,58 @@ async def batch_scan_from_image(
 
     b = Batch(product_id=product_id, store_id=store_id, expiry_date=expiry.date(),
               lot_code=lot, qty_received=qty, qty_on_hand=qty)
-    db.add(b); db.commit(); db.refresh(b)
+    db.add(b); db.commit()
     return {"batch_id": b.id, "expiry_date": str(b.expiry_date), "lot_code": lot, "qty": qty}
 
 @app.post("/products")
 def create_product(body: ProductCreate, db: Session = Depends(get_db)):
     if body.barcode_gtin:
-        exists = db.query(Product).filter(Product.barcode_gtin == body.barcode_gtin).first()
+        exists = db.query(Product.id).filter(Product.barcode_gtin == body.barcode_gtin).first()
         if exists:
             return {"ok": True, "id": exists.id, "note": "already exists by barcode"}
-    exists_sku = db.query(Product).filter(Product.sku == body.sku).first()
+    exists_sku = db.query(Product.id).filter(Product.sku == body.sku).first()
     if exists_sku:
         return {"ok": True, "id": exists_sku.id, "note": "already exists by sku"}
 
-    p = Product(**body.dict())
-    db.add(p); db.commit(); db.refresh(p)
+    p = Product(**body.model_dump())
+    db.add(p); db.commit()
     return {"ok": True, "id": p.id}
 
 @app.post("/products/bulk")
 def create_products_bulk(items: List[ProductCreate], db: Session = Depends(get_db)):
-    created = 0
+    # mevcut SKU/barkodlar iki IN sorgusuyla (satır başına SELECT yok)
+    skus = {body.sku for body in items}
+    barcodes = {body.barcode_gtin for body in items if body.barcode_gtin}
+    seen_skus = {sku for (sku,) in db.query(Product.sku).filter(Product.sku.in_(skus))} if skus else set()
+    seen_barcodes = ({gtin for (gtin,) in db.query(Product.barcode_gtin).filter(Product.barcode_gtin.in_(barcodes))}
+                     if barcodes else set())
+    rows = []
     for body in items:
-        if body.barcode_gtin:
-            exists = db.query(Product).filter(Product.barcode_gtin == body.barcode_gtin).first()
-            if exists:
-                continue
-        if db.query(Product).filter(Product.sku == body.sku).first():
+        if body.barcode_gtin and body.barcode_gtin in seen_barcodes:
+            continue
+        if body.sku in seen_skus:
             continue
-        p = Product(**body.dict())
-        db.add(p); created += 1
+        rows.append(body.model_dump())
+        # aynı CSV içindeki tekrarlar da atlanır
+        seen_skus.add(body.sku)
+        if body.barcode_gtin:
+            seen_barcodes.add(body.barcode_gtin)
+    # satır başına ORM nesnesi yerine tek executemany INSERT
+    if rows:
+        db.execute(insert(Product), rows)
     db.commit()
-    return {"ok": True, "created": created, "count": db.query(Product).count()}
+    return {"ok": True, "created": len(rows), "count": db.query(func.count(Product.id)).scalar()}
 
 @app.get("/products")
-def products_list(q: str | None = None, sku_or_id: str | None = None, limit: int = 30, db: Session = Depends(get_db)):
-    qs = db.query(Product)
+def products_list(q: str | None = None, sku_or_id: str | None = None, limit: int = 30,
+                  after_id: int | None = None, db: Session = Depends(get_db)):
+    # yalnızca yanıttaki kolonlar (image_url vb. tam entity yüklenmez)
+    qs = db.query(Product.id, Product.sku, Product.name, Product.barcode_gtin,
+                  Product.category, Product.shelf_life_days)
+    # keyset sayfalama: sonraki sayfa için son görülen id'yi after_id olarak gönder
+    if after_id is not None:
+        qs = qs.filter(Product.id > after_id)
+    qs = qs.order_by(Product.id)
     if sku_or_id:
         if sku_or_id.isdigit():
             qs = qs.filter(Product.id == int(sku_or_id))
@@ -403,42 +484,63 @@ def products_list(q: str | None = None, sku_or_id: str | None = None, limit: int
     else:
         prods = qs.limit(limit).all()
 
-    out = []
-    for p in prods:
-        out.append({
-            "id": p.id,
-            "sku": p.sku,
-            "name": p.name,
-            "barcode_gtin": p.barcode_gtin,
-            "category": p.category,
-            "shelf_life_days": p.shelf_life_days
-        })
-    return out
+    return [p._asdict() for p in prods]
 
 # -----------------------------
 # Dashboard summary + alerts actions
 # -----------------------------
 def ensure_expiry_alert_columns(db: Session):
     table = "expiry_alerts"
+    # PRAGMA yalnızca SQLite'ta çalışır; inspector tüm dialect'lerde (SQLite/Postgres)
     try:
-        cols = [r[1] for r in db.execute(f"PRAGMA table_info({table})").fetchall()]
+        cols = [c["name"] for c in inspect(db.get_bind()).get_columns(table)]
     except Exception:
         return
     try:
         if "status" not in cols:
-            db.execute(f"ALTER TABLE {table} ADD COLUMN status TEXT DEFAULT 'new'")
+            db.execute(text(f"ALTER TABLE {table} ADD COLUMN status TEXT DEFAULT 'new'"))
         if "snooze_until" not in cols:
-            db.execute(f"ALTER TABLE {table} ADD COLUMN snooze_until DATE")
+            db.execute(text(f"ALTER TABLE {table} ADD COLUMN snooze_until DATE"))
         db.commit()
     except Exception:
         db.rollback()
         return
 
+# store_id ile başlayan composite index'ler bunları kapsıyor; eski DB'lerde kaldırılır
+_REDUNDANT_INDEXES = ("ix_batches_store_id", "ix_sales_store_id", "ix_expiry_alerts_store_id",
+                      "ix_reorder_policies_store_id", "ix_forecasts_store_id")
+
+def ensure_indexes():
+    # create_all mevcut tablolara sonradan eklenen index'leri oluşturmaz
+    for table in Base.metadata.sorted_tables:
+        for ix in table.indexes:
+            try:
+                ix.create(bind=engine, checkfirst=True)
+            except Exception:
+                pass
+    for name in _REDUNDANT_INDEXES:
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        except Exception:
+            pass
+    # PostgreSQL'de '%terim%' ilike araması için trigram GIN index'leri (SQLite'ta atlanır)
+    if engine.dialect.name == "postgresql":
+        try:
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                for col in ("name", "sku", "barcode_gtin"):
+                    conn.execute(text(f"CREATE INDEX IF NOT EXISTS ix_products_{col}_trgm "
+                                      f"ON products USING gin ({col} gin_trgm_ops)"))
+        except Exception:
+            pass
+
 @app.on_event("startup")
 def startup_migrations_and_checks():
     try:
         db = next(get_db())
         ensure_expiry_alert_columns(db)
+        ensure_indexes()
         try:
             db.close()
         except Exception:
@@ -453,30 +555,38 @@ def dashboard_summary(store_id: int = 1, days: int = 7, db: Session = Depends(ge
     except Exception:
         pass
 
-    expiry_count = 0
+    # son faturalar satır sayılarıyla tek sorguda (UI line_count gösteriyor)
+    recent = _recent_invoices(db, 5)
+
+    # iki sayaç tek SELECT'te, skaler alt sorgular olarak
+    expiry_q = (db.query(func.count(ExpiryAlert.id))
+                  .filter(ExpiryAlert.store_id == store_id,
+                          ExpiryAlert.days_left <= days,
+                          (ExpiryAlert.status == None) | (ExpiryAlert.status != 'ack'))
+                  .scalar_subquery())
+    # ürün başına stok + mağaza politikası (politika yoksa eşik 5)
+    sub = db.query(Batch.product_id, func.sum(Batch.qty_on_hand).label("on_hand")).group_by(Batch.product_id).subquery()
+    low_stock_q = (db.query(func.count(func.distinct(sub.c.product_id)))
+                     .select_from(sub)
+                     .outerjoin(ReorderPolicy, and_(ReorderPolicy.product_id == sub.c.product_id,
+                                                    ReorderPolicy.store_id == store_id))
+                     .filter(sub.c.on_hand <= func.coalesce(ReorderPolicy.min_stock, 5))
+                     .scalar_subquery())
+    expiry_count, low_stock_count = 0, 0
     try:
-        expiry_count = db.query(ExpiryAlert).filter(
-            ExpiryAlert.store_id == store_id,
-            ExpiryAlert.days_left <= days,
-            (ExpiryAlert.status == None) | (ExpiryAlert.status != 'ack')
-        ).count()
+        expiry_count, low_stock_count = db.query(expiry_q, low_stock_q).one()
     except Exception:
-        expiry_count = 0
-
-    recent_invoices_q = db.query(Invoice).order_by(Invoice.id.desc()).limit(5).all()
-    recent = [{"id": inv.id, "created_at": inv.created_at.isoformat() if inv.created_at else None} for inv in recent_invoices_q]
-
-    low_stock_count = 0
-    try:
-        sub = db.query(Batch.product_id, func.sum(Batch.qty_on_hand).label("on_hand")).group_by(Batch.product_id).subquery()
-        rows = db.query(sub.c.product_id, sub.c.on_hand).all()
-        for pid, on_hand in rows:
-            pol = db.query(ReorderPolicy).filter_by(store_id=store_id, product_id=pid).first()
-            min_stock = pol.min_stock if pol else 5
-            if on_hand <= min_stock:
-                low_stock_count += 1
-    except Exception:
-        low_stock_count = 0
+        db.rollback()
+        # birleşik sorgu patlarsa sayaçlar ayrı ayrı denenir: biri hatalıysa
+        # yalnızca o 0 döner, diğeri etkilenmez
+        try:
+            expiry_count = db.query(expiry_q).scalar()
+        except Exception:
+            db.rollback()
+        try:
+            low_stock_count = db.query(low_stock_q).scalar()
+        except Exception:
+            db.rollback()
 
     return {
         "expiry_count": expiry_count,
@@ -491,14 +601,19 @@ def alerts_expiry_full(store_id: int = 1, days: int = 30, db: Session = Depends(
     except Exception:
         pass
     try:
-        alerts = db.query(ExpiryAlert).filter(ExpiryAlert.store_id==store_id).order_by(ExpiryAlert.days_left.asc()).all()
+        # ürün adı aynı sorguda (UI'nin uyarı başına ürün çekmesine gerek kalmaz)
+        alerts = (db.query(ExpiryAlert, Product.name)
+                    .outerjoin(Product, Product.id == ExpiryAlert.product_id)
+                    .filter(ExpiryAlert.store_id==store_id)
+                    .order_by(ExpiryAlert.days_left.asc()).all())
     except Exception:
         alerts = []
     out = []
-    for a in alerts:
+    for a, product_name in alerts:
         out.append({
             "id": a.id,
             "product_id": a.product_id,
+            "product_name": product_name,
             "batch_id": a.batch_id,
             "expiry_date": str(a.expiry_date),
             "days_left": a.days_left,
@@ -515,31 +630,30 @@ class AlertActionReq(BaseModel):
 
 @app.post("/alerts/{alert_id}/ack")
 def ack_alert(alert_id: int, body: AlertActionReq = Body(...), db: Session = Depends(get_db)):
-    a = db.query(ExpiryAlert).filter_by(id=alert_id).first()
-    if not a:
-        raise HTTPException(status_code=404, detail="alert not found")
     try:
-        setattr(a, "status", "ack")
+        updated = (db.query(ExpiryAlert).filter_by(id=alert_id)
+                     .update({"status": "ack"}, synchronize_session=False))
         db.commit()
     except Exception:
         db.rollback()
         raise
+    if not updated:
+        raise HTTPException(status_code=404, detail="alert not found")
     return {"ok": True, "alert_id": alert_id, "status": "ack"}
 
 @app.post("/alerts/{alert_id}/snooze")
 def snooze_alert(alert_id: int, body: AlertActionReq = Body(...), db: Session = Depends(get_db)):
-    a = db.query(ExpiryAlert).filter_by(id=alert_id).first()
-    if not a:
-        raise HTTPException(status_code=404, detail="alert not found")
     days = body.days or 1
     snooze_until = (datetime.utcnow() + timedelta(days=days)).date()
     try:
-        setattr(a, "snooze_until", snooze_until)
-        setattr(a, "status", "snoozed")
+        updated = (db.query(ExpiryAlert).filter_by(id=alert_id)
+                     .update({"snooze_until": snooze_until, "status": "snoozed"}, synchronize_session=False))
         db.commit()
     except Exception:
         db.rollback()
         raise
+    if not updated:
+        raise HTTPException(status_code=404, detail="alert not found")
     return {"ok": True, "alert_id": alert_id, "snooze_until": str(snooze_until)}
 
 # -----------------------------
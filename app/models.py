@@ -1,5 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Date, Text
-from sqlalchemy.orm import relationship
+from sqlalchemy import Column, Integer, String, DateTime, Float, ForeignKey, Date, Text, Index
+from sqlalchemy.orm import relationship, deferred
 from datetime import datetime
 from .db import Base
 
@@ -23,7 +23,8 @@ class Invoice(Base):
     invoice_no = Column(String, index=True)
     invoice_date = Column(Date)
     raw_image_path = Column(String)
-    ocr_json = Column(Text)
+    # ham OCR çıktısı büyük olabilir; yalnızca erişildiğinde yüklenir
+    ocr_json = deferred(Column(Text))
     status = Column(String, default="parsed")
     created_at = Column(DateTime, default=datetime.utcnow)
     file_hash = Column(String(64), unique=True, index=True, nullable=True)
@@ -31,7 +32,7 @@ class Invoice(Base):
 class InvoiceLine(Base):
     __tablename__ = "invoice_lines"
     id = Column(Integer, primary_key=True)
-    invoice_id = Column(Integer, ForeignKey("invoices.id"))
+    invoice_id = Column(Integer, ForeignKey("invoices.id"), index=True)
     product_id = Column(Integer, ForeignKey("products.id"), nullable=True)
     supplier_sku = Column(String)
     name_raw = Column(String)
@@ -41,9 +42,13 @@ class InvoiceLine(Base):
 
 class Batch(Base):
     __tablename__ = "batches"
+    __table_args__ = (
+        # refresh_expiry_alerts: store_id + expiry_date <= cutoff
+        Index("ix_batches_store_expiry", "store_id", "expiry_date"),
+    )
     id = Column(Integer, primary_key=True)
     product_id = Column(Integer, ForeignKey("products.id"))
-    store_id = Column(Integer, index=True, default=1)
+    store_id = Column(Integer, default=1)
     lot_code = Column(String)
     expiry_date = Column(Date)
     qty_received = Column(Float, default=0)
@@ -53,16 +58,25 @@ class Batch(Base):
 
 class Sale(Base):
     __tablename__ = "sales"
+    __table_args__ = (
+        # naive_hourly_forecast: mağaza + ürün satışları, ts aralığı
+        Index("ix_sales_store_product_ts", "store_id", "product_id", "ts"),
+    )
     id = Column(Integer, primary_key=True)
-    store_id = Column(Integer, index=True, default=1)
+    store_id = Column(Integer, default=1)
     product_id = Column(Integer, ForeignKey("products.id"))
     ts = Column(DateTime, index=True)
     qty = Column(Float)
 
 class ExpiryAlert(Base):
     __tablename__ = "expiry_alerts"
+    __table_args__ = (
+        # refresh_expiry_alerts batch araması + days_left'e göre listeleme/sayım
+        Index("ix_expiry_alerts_store_batch", "store_id", "batch_id"),
+        Index("ix_expiry_alerts_store_days_left", "store_id", "days_left"),
+    )
     id = Column(Integer, primary_key=True)
-    store_id = Column(Integer, index=True)
+    store_id = Column(Integer)
     product_id = Column(Integer, ForeignKey("products.id"))
     batch_id = Column(Integer, ForeignKey("batches.id"))
     expiry_date = Column(Date)
@@ -70,11 +84,20 @@ class ExpiryAlert(Base):
     severity = Column(String)  # red / yellow
     created_at = Column(DateTime, default=datetime.utcnow)
     resolved_at = Column(DateTime, nullable=True)
+    status = Column(String, default="new")  # new / ack / snoozed
+    snooze_until = Column(Date, nullable=True)
+
+# dedupe_alerts: GROUP BY batch_id, product_id (script doğrudan bu nesneyi oluşturur)
+ix_expiry_alerts_batch_product = Index("ix_expiry_alerts_batch_product",
+                                       ExpiryAlert.batch_id, ExpiryAlert.product_id)
 
 class ReorderPolicy(Base):
     __tablename__ = "reorder_policies"
+    __table_args__ = (
+        Index("ix_reorder_policies_store_product", "store_id", "product_id"),
+    )
     id = Column(Integer, primary_key=True)
-    store_id = Column(Integer, index=True)
+    store_id = Column(Integer)
     product_id = Column(Integer, ForeignKey("products.id"))
     min_stock = Column(Float, default=0)
     max_stock = Column(Float, default=0)
@@ -83,8 +106,12 @@ class ReorderPolicy(Base):
 
 class Forecast(Base):
     __tablename__ = "forecasts"
+    __table_args__ = (
+        # reorder okuması + naive_hourly_forecast'in aralık silmesi
+        Index("ix_forecasts_store_product_horizon_ts", "store_id", "product_id", "horizon", "ts"),
+    )
     id = Column(Integer, primary_key=True)
-    store_id = Column(Integer, index=True)
+    store_id = Column(Integer)
     product_id = Column(Integer, ForeignKey("products.id"))
     horizon = Column(String)  # e.g. 'hourly'
     ts = Column(DateTime, index=True)
@@ -126,7 +126,8 @@ def parse_invoice_lines(ocr_text: str) -> List[Dict]:
 
             # Fiyat adaylarını topla
             money_tokens = re.findall(rf"{NUM}", rest)
-            money_vals = [_to_float(tok) for tok in money_tokens if _to_float(tok) > 0]
+            # her token tek kez çevrilir
+            money_vals = [v for v in map(_to_float, money_tokens) if v > 0]
 
             line_total = 0.0
             unit_price = 0.0
@@ -1,23 +1,32 @@
 from pathlib import Path
 import uuid, os
+import shutil
 import hashlib
 
 UPLOAD_DIR = Path("data/uploads")
 UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
 
-def save_upload(file_obj, filename_hint="invoice") -> str:
+def _upload_path(file_obj, filename_hint: str) -> Path:
     ext = Path(file_obj.filename).suffix if hasattr(file_obj, "filename") else ".jpg"
-    out = UPLOAD_DIR / f"{filename_hint}_{uuid.uuid4().hex}{ext}"
+    return UPLOAD_DIR / f"{filename_hint}_{uuid.uuid4().hex}{ext}"
+
+def save_upload(file_obj, filename_hint="invoice", chunk_size: int = 1 << 20) -> str:
+    # parça parça kopyala; tüm dosya belleğe alınmaz
+    out = _upload_path(file_obj, filename_hint)
     with open(out, "wb") as f:
-        f.write(file_obj.file.read())
+        shutil.copyfileobj(file_obj.file, f, chunk_size)
     return str(out)
 
-def file_md5(path: str, chunk_size: int = 1 << 20) -> str:
+def save_upload_md5(file_obj, filename_hint="invoice", chunk_size: int = 1 << 20) -> tuple[str, str]:
+    # dosyayı parça parça yaz ve aynı geçişte MD5'ini hesapla
+    # (tüm dosya belleğe alınmaz, diskten ikinci kez okunmaz)
+    out = _upload_path(file_obj, filename_hint)
     h = hashlib.md5()
-    with open(path, "rb") as f:
+    with open(out, "wb") as f:
         while True:
-            chunk = f.read(chunk_size)
+            chunk = file_obj.file.read(chunk_size)
             if not chunk:
                 break
             h.update(chunk)
-    return h.hexdigest()
+            f.write(chunk)
+    return str(out), h.hexdigest()